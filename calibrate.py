@@ -1,24 +1,18 @@
 import os
 import os.path as osp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
-from matplotlib import cm
-from scipy.ndimage import shift
 from features import *
 from radar import *
 import argparse
 
-from matplotlib import style
-style.use('seaborn-white')
-plt.rcParams['font.family'] = 'serif'
-
 # Converts an array of target locations (N x 2) into a binary polar image
 def targets_to_polar_image(targets, shape):
-    polar = np.zeros(shape)
-    N = targets.shape[0]
-    for i in range(0, N):
-        polar[targets[i, 0], targets[i, 1]] = 255
+    targets = targets.reshape(-1, 2)    # cen2018features returns shape (0,) when no targets are found
+    polar = np.zeros(shape, dtype=np.uint8)
+    polar[targets[:, 0].astype(np.intp), targets[:, 1].astype(np.intp)] = 255
     return polar
 
 # Returns a 3 x 3 rotation matrix for a given theta (yaw about the z axis)
@@ -27,42 +21,48 @@ def get_rotation(theta):
     R[0:2, 0:2] = np.array([[np.cos(theta), np.sin(theta)],[-np.sin(theta), np.cos(theta)]])
     return R
 
-def load_lidar(path):
-    points = np.loadtxt(path, delimiter=',', dtype=np.float32)
-    return points[:, :3].T
+# Loads the points of a lidar csv / txt file whose height lies in [z_min, z_max] as a contiguous 2 x N float32 array (x, y)
+def load_lidar(path, z_min=0.0, z_max=0.5):
+    points = np.loadtxt(path, delimiter=',', dtype=np.float32, usecols=(0, 1, 2), ndmin=2)
+    in_band = (points[:, 2] >= z_min) & (points[:, 2] <= z_max)
+    return np.ascontiguousarray(points[in_band, :2].T)
 
-# Converts a lidar point cloud (3 x N) into a top-down cartesian image
+# Converts a lidar point cloud (2 x N) into a top-down cartesian image
 def lidar_to_cartesian_image(pc, cart_pixel_width, cart_resolution):
     if (cart_pixel_width % 2) == 0:
         cart_min_range = (cart_pixel_width / 2 - 0.5) * cart_resolution
     else:
         cart_min_range = cart_pixel_width // 2 * cart_resolution
-    cart_img = np.zeros((cart_pixel_width, cart_pixel_width))
-    for i in range(0, pc.shape[1]):
-        if pc[2, i] < -0 or pc[2, i] > 0.5:
-            continue
-        u = int((cart_min_range - pc[1, i]) / cart_resolution)
-        v = int((cart_min_range - pc[0, i]) / cart_resolution)
-        if 0 < u and u < cart_pixel_width and 0 < v and v < cart_pixel_width:
-            cart_img[v, u] = 255
+    inv_resolution = 1.0 / cart_resolution
+    u = ((cart_min_range - pc[1]) * inv_resolution).astype(np.int32)
+    v = ((cart_min_range - pc[0]) * inv_resolution).astype(np.int32)
+    valid = (0 < u) & (u < cart_pixel_width) & (0 < v) & (v < cart_pixel_width)
+    cart_img = np.zeros((cart_pixel_width, cart_pixel_width), dtype=np.uint8)
+    np.put(cart_img, v[valid] * cart_pixel_width + u[valid], 255)    # flat indices scatter faster than (v, u) pairs
     return cart_img
 
-# Converts lidar point cloud (3 x N) into a top-down polar image (azimuth x range)
+# Converts lidar point cloud (2 x N) into a top-down polar image (azimuth x range)
 def lidar_to_polar_image(pc, range_resolution, azimuth_resolution, range_bins, azimuth_bins):
-    polar = np.zeros((azimuth_bins, range_bins))
-    for i in range(0, pc.shape[1]):
-        if x[2, i] < -0 or x[2, i] > 0.5:
-            continue
-        r = np.sqrt(x[0, i]**2 + x[1, i]**2)
-        theta = np.arctan2(x[1, i], x[0, i])
-        if theta < 0:
-            theta += 2 * np.pi
-        range_bin = int(r / range_resolution)
-        azimuth_bin = int(theta / azimuth_resolution)
-        if 0 < range_bin and range_bin < range_bins and 0 < azimuth_bin and azimuth_bin < azimuth_bins:
-            polar[azimuth_bin, range_bin] = 255
-    polar = np.flip(polar, axis=0)
-    return polar
+    x, y = pc[0], pc[1]
+    range_bin = (np.hypot(x, y) * (1.0 / range_resolution)).astype(np.int32)
+    azimuth_bin = ((np.arctan2(y, x) % (2 * np.pi)) * (1.0 / azimuth_resolution)).astype(np.int32)
+    valid = (0 < range_bin) & (range_bin < range_bins) & (0 < azimuth_bin) & (azimuth_bin < azimuth_bins)
+    polar = np.zeros((azimuth_bins, range_bins), dtype=np.uint8)
+    np.put(polar, azimuth_bin[valid] * range_bins + range_bin[valid], 255)
+    return polar[::-1]
+
+# float32 phaseCorrelate inputs keyed by image shape; every frame has the same polar / cartesian shapes
+_correlation_workspaces = {}
+
+# Phase correlates two equally sized images, returning the sub-pixel (column, row) shift of img2 relative to img1
+# cv2.phaseCorrelate runs the whole cv2.dft -> cv2.mulSpectrums (conjugate) -> normalise -> cv2.idft chain in native code
+def phase_correlate(img1, img2):
+    if img1.shape not in _correlation_workspaces:
+        _correlation_workspaces[img1.shape] = np.empty((2,) + img1.shape, dtype=np.float32)
+    a, b = _correlation_workspaces[img1.shape]
+    np.copyto(a, img1)
+    np.copyto(b, img2)
+    return cv2.phaseCorrelate(a, b)
 
 def get_closest_frame(query_time, target_times, targets):
     times = np.array(target_times)
@@ -70,18 +70,80 @@ def get_closest_frame(query_time, target_times, targets):
     assert(np.abs(query_time - times[closest]) < 1.0), "closest time to query: {} in rostimes not found.".format(query_time)
     return targets[closest]
 
+# Estimates the lidar-to-radar rotation (and optionally the translation) from a single radar / lidar pair
+# Returns (rotation_index, rotation, response, xbar, polar, azimuths); xbar is None when translation is not estimated
+# rotation_index, rotation and xbar are None (and response 0) when the radar or lidar polar image has no set pixels
+def process_frame(radar_path, lidar_path, fix_azimuths, feature_std, x_offset, y_offset, radar_resolution, max_bins,
+                  azimuth_step, upsample_azimuths, calibrate_translation, cart_res2, cart_width2):
+    # Load radar data, extract radar target locations and convert these into a polar image
+    times, azimuths, _, fft_data = load_radar(radar_path, fix_azimuths)
+    fft_data = fft_data[:, :max_bins]
+    azimuth_bins = fft_data.shape[0]
+    range_bins = fft_data.shape[1]
+    targets = cen2018features(fft_data, 58, feature_std, 17)
+    polar = targets_to_polar_image(targets, fft_data.shape)
+
+    # Upsample the binary target image along the azimuth axis, targets are detected at the native resolution
+    if upsample_azimuths > 1.0:
+        polar = np.repeat(polar, upsample_azimuths, axis=0)
+        query = np.arange(0, azimuth_bins, 1.0 / float(upsample_azimuths))
+        xp = np.arange(0, azimuth_bins)
+        azimuths = np.interp(query, xp, azimuths.squeeze()).astype(np.float32).reshape(-1, 1)
+        assert(polar.shape[0] == azimuths.shape[0])
+    polar[polar.shape[0]//4:3*polar.shape[0]//4,:] = 0
+
+    # Load lidar data and convert it into a polar image
+    x = load_lidar(lidar_path)
+    x[0, ...] = x[0, ...] + x_offset
+    x[1, ...] = x[1, ...] + y_offset
+    polar_lidar = lidar_to_polar_image(x, radar_resolution, azimuth_step, range_bins, azimuth_bins * upsample_azimuths)
+
+    # An empty image has no correlation peak, phaseCorrelate would report the image centre (a rotation of pi)
+    if not polar.any() or not polar_lidar.any():
+        return None, None, 0.0, None, polar, azimuths
+
+    # Estimate the rotation using the Fourier Mellin transform on the polar images
+    # phaseCorrelate zero-pads both axes to cv2.getOptimalDFTSize; padding the azimuth axis would break the
+    # circular wrap-around the rotation relies on, so the row count must already be an optimal DFT size
+    assert(cv2.getOptimalDFTSize(polar.shape[0]) == polar.shape[0]), \
+        "{} azimuth rows is not an optimal DFT size, the rotation would not wrap around".format(polar.shape[0])
+    offset, response = phase_correlate(polar, polar_lidar)
+    rotation_index = np.mod(offset[1], polar.shape[0])
+    rotation = rotation_index * azimuth_step
+    if rotation > np.pi:
+        rotation = 2 * np.pi - rotation
+    R = get_rotation(rotation).astype(np.float32) # Rotation to convert points in lidar frame to points in radar frame (R_12)
+
+    # Rotate the lidar scan such that only the translation offset remains
+    # R is a pure yaw, so its 2 x 2 block rotates the (x, y) points
+    xprime = np.matmul(R[:2, :2], x)
+
+    # Estimate the translation using the Fourier Mellin transform on the cartesian images
+    xbar = None
+    if calibrate_translation:
+        cart1 = radar_polar_to_cartesian(azimuths, polar, radar_resolution, cart_res2, cart_width2)
+        cart2 = lidar_to_cartesian_image(xprime, cart_width2, cart_res2)
+        offset, _ = phase_correlate(cart1, cart2)
+        delta_x = offset[1] * cart_res2
+        delta_y = offset[0] * cart_res2
+        xbar = np.array([delta_x, delta_y, 1]).reshape(3, 1)
+
+    return rotation_index, rotation, response, xbar, polar, azimuths
+
 if __name__ == "__main__":
     # Load arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--root', type=str, help='path to /lidar and /radar')
     parser.add_argument('--resolution', type=float, default=0.0438, help='range resolution of radar')
     parser.add_argument('--light_mode', action='store_true', help='use light_mode when making radar-to-lidar plots')
-    parser.add_argument('--visualize_results', action='store_true', default=True)
+    parser.add_argument('--visualize_results', action=argparse.BooleanOptionalAction, default=True, help='plot the estimates and write radar-to-lidar overlays to figs/')
     parser.add_argument('--fix_azimuths', action='store_true')
     parser.add_argument('--azimuth_bins', type=int, default=400, help='number of azimuth measurements made by radar per rotation')
     parser.add_argument('--x_offset', type=float, default=0.4, help='translational x offset from radar to lidar (m)')
     parser.add_argument('--y_offset', type=float, default=-0.15, help='translational y offset from radar to lidar (m)')
     parser.add_argument('--feature_std', type=float, default=3.0, help='feature detection standard deviation threshold')
+    parser.add_argument('--min_response', type=float, default=0.01, help='frames whose phase correlation response is below this are dropped')
+    parser.add_argument('--workers', type=int, default=None, help='number of frames processed in parallel (default: number of CPUs)')
     args = parser.parse_args()
     root = args.root
     radar_resolution = args.resolution
@@ -92,6 +154,7 @@ if __name__ == "__main__":
     x_offset = args.x_offset
     y_offset = args.y_offset
     feature_std = args.feature_std
+    min_response = args.min_response
     
     # Get lidar and radar files
     radar_root = osp.join(root, 'radar')
@@ -122,78 +185,39 @@ if __name__ == "__main__":
 
     rotations = []
     translations = []
+    radar_cache = []    # (polar, azimuths) per frame, reused by the visualization pass
 
-    for i in range(0, len(radar_files)):
-        # Load radar data and upsample along azimuth axis
-        times, azimuths, _, fft_data = load_radar(osp.join(radar_root, radar_files[i]), fix_azimuths)
-        fft_data = fft_data[:, :max_bins]
-        azimuth_bins = fft_data.shape[0]
-        range_bins = fft_data.shape[1]
-        if upsample_azimuths > 1.0:
-            fft_data = cv2.resize(fft_data, dsize = (0, 0), fx = 1, fy = upsample_azimuths, interpolation = cv2.INTER_CUBIC)
-            query = np.arange(0, azimuth_bins, 1.0 / float(upsample_azimuths))
-            xp = np.arange(0, azimuth_bins)
-            azimuths = np.interp(query, xp, azimuths.squeeze()).reshape(-1, 1)
-            assert(fft_data.shape[0] == azimuths.shape[0])
-
-        # Extract radar target locations and convert these into polar and cartesian images
-        targets = cen2018features(fft_data, 58, feature_std, 17)
-        polar = targets_to_polar_image(targets, fft_data.shape)
-        polar[polar.shape[0]//4:3*polar.shape[0]//4,:] = 0
-        cart = radar_polar_to_cartesian(azimuths, polar, radar_resolution, cart_resolution, cart_pixel_width)
-        cart = np.where(cart > 0, 255, 0)
-
-        # Load lidar data and convert it into polar and cartesian images
-        x = load_lidar(osp.join(lidar_root, lidar_files[i]))
-        x[0, ...] = x[0, ...] + x_offset
-        x[1, ...] = x[1, ...] + y_offset
-        cart_lidar = lidar_to_cartesian_image(x, cart_pixel_width, cart_resolution)
-        polar_lidar = lidar_to_polar_image(x, radar_resolution, azimuth_step, range_bins, azimuth_bins * upsample_azimuths)
+    # Frames are independent, so they are processed in parallel. OpenCV is limited to one thread per worker
+    # so that phaseCorrelate / remap do not oversubscribe the cores
+    frame = partial(process_frame, fix_azimuths=fix_azimuths, feature_std=feature_std, x_offset=x_offset,
+                    y_offset=y_offset, radar_resolution=radar_resolution, max_bins=max_bins, azimuth_step=azimuth_step,
+                    upsample_azimuths=upsample_azimuths, calibrate_translation=calibrate_translation,
+                    cart_res2=cart_res2, cart_width2=cart_width2)
+    radar_paths = [osp.join(radar_root, f) for f in radar_files]
+    lidar_paths = [osp.join(lidar_root, f) for f in lidar_files]
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=cv2.setNumThreads, initargs=(1,)) as pool:
+        results = list(pool.map(frame, radar_paths, lidar_paths))
 
-        # Estimate the rotation using the Fourier Mellin transform on the polar images
-        f1 = np.fft.fft2(polar)
-        f2 = np.fft.fft2(polar_lidar)
-        p = (f2 * f1.conjugate())
-        p = p / abs(p)
-        p = np.fft.ifft2(p)
-        p = abs(p)
-        rotation_index = np.where(p == np.amax(p))[0][0]
-        rotation = rotation_index * azimuth_step
-        if rotation > np.pi:
-            rotation = 2 * np.pi - rotation
-        print('rotation index: {} rotation: {} radians, {} degrees'.format(rotation_index, rotation, rotation * 180 / np.pi))
+    for radar_file, (rotation_index, rotation, response, xbar, polar, azimuths) in zip(radar_files, results):
+        if visualize_results:
+            radar_cache.append((polar, azimuths))
+        if rotation is None:
+            print('warning: dropping {}: no radar targets or no lidar points in the polar image'.format(radar_file))
+            continue
+        if response < min_response:
+            print('warning: dropping {}: phase correlation response {:.3f} is below {}'.format(radar_file, response, min_response))
+            continue
+        print('rotation index: {:.2f} rotation: {} radians, {} degrees | response: {:.3f}'.format(rotation_index, rotation, rotation * 180 / np.pi, response))
         rotations.append(rotation)
-        R = get_rotation(rotation) # Rotation to convert points in lidar frame to points in radar frame (R_12)
-
-        # Rotate the lidar scan such that only the translation offset remains
-        xprime = x
-        for j in range(0, x.shape[1]):
-            xprime[:,j] = np.squeeze(np.matmul(R, x[:,j].reshape(3,1)))
-
-        # Estimate the translation using the Fourier Mellin transform on the cartesian images
         if calibrate_translation:
-            cart1 = radar_polar_to_cartesian(azimuths, polar, radar_resolution, cart_res2, cart_width2)
-            cart2 = lidar_to_cartesian_image(xprime, cart_width2, cart_res2)
-            f1 = np.fft.fft2(cart1)
-            f2 = np.fft.fft2(cart2)
-            p = (f2 * f1.conjugate())
-            p = p / abs(p)
-            p = np.fft.ifft2(p)
-            p = abs(p)
-            delta_x = np.where(p == np.amax(p))[0][0]
-            delta_y = np.where(p == np.amax(p))[1][0]
-            if delta_x > cart_width2 / 2:
-                delta_x -= cart_width2
-            if delta_y > cart_width2 / 2:
-                delta_y -= cart_width2
-            delta_x *= cart_res2
-            delta_y *= cart_res2
-            xbar = np.array([delta_x, delta_y, 1]).reshape(3, 1)
             print('delta_x: {} delta_y: {}'.format(xbar[0], xbar[1]))
             translations.append(xbar.transpose())
 
+    assert(len(rotations) > 0), "no frame produced a usable rotation estimate"
     rotations = np.array(rotations)
-    rotation = np.mean(rotations[np.abs(rotations - rotation.mean()) < 3 * rotations.std()])
+    # Average the estimates within 3 standard deviations of the mean; <= keeps every estimate when they all agree
+    inliers = np.abs(rotations - rotations.mean()) <= 3 * rotations.std()
+    rotation = np.mean(rotations[inliers])
     print(f'rotation: {rotation} radians, {np.rad2deg(rotation)} degrees | StD: {rotations.std()} radians, {np.rad2deg(rotations.std())} degrees')
     if calibrate_translation:
         translations = np.array(translations)
@@ -201,11 +225,18 @@ if __name__ == "__main__":
         print('x: {} y : {} z : {}'.format(translation[0, 0], translation[0, 1], translation[0, 2]))
 
     if visualize_results:
+        # matplotlib is only needed here, importing it lazily keeps --no-visualize_results runs fast to start
+        import matplotlib.pyplot as plt
+        from matplotlib import cm
+        from matplotlib import style
+        style.use('seaborn-white')
+        plt.rcParams['font.family'] = 'serif'
+
         cart_resolution = 0.25
         cart_pixel_width = 800
         azimuth_step = np.pi / 200
         azimuth_bins = 400
-        R = get_rotation(rotation)
+        R = get_rotation(rotation).astype(np.float32)
         print(rotations)
         plt.plot(np.array(range(rotations.shape[0])), np.rad2deg(rotations), 'bo--')
         plt.title("Rotation Calibration Results")
@@ -220,64 +251,55 @@ if __name__ == "__main__":
             plt.xlabel("X")
             plt.show()
         
-        for i in range(0, len(radar_files)):
-            _, azimuths, _, fft_data = load_radar(osp.join(radar_root, radar_files[i]), fix_azimuths)
-            targets = cen2018features(fft_data, 58, feature_std, 17)
-            polar = targets_to_polar_image(targets, fft_data.shape)
-            polar[polar.shape[0]//4:3*polar.shape[0]//4,:] = 0
-            cart = radar_polar_to_cartesian(azimuths, polar, radar_resolution, cart_resolution, cart_pixel_width)
-            cart = np.where(cart > 0, 255, 0)
-            x = load_lidar(osp.join(lidar_root, lidar_files[i]))
-            x[0, ...] = x[0, ...] + x_offset
-            x[1, ...] = x[1, ...] + y_offset
-            cart_lidar = lidar_to_cartesian_image(x, cart_pixel_width, cart_resolution)
-            for j in range(0, x.shape[1]):
-                x[:,j] = np.squeeze(np.matmul(R, x[:,j].reshape(3,1)))
-            cart_lidar2 = lidar_to_cartesian_image(x, cart_pixel_width, cart_resolution)
-            if light_mode:
-                rgb = np.zeros((cart_pixel_width, cart_pixel_width, 3), np.uint8) * 255
-                
-                mask = np.logical_not(cart_lidar2 == 255)
-                mask2 = np.logical_not(cart == 255)
+        # PNG encoding releases the GIL, so the writes overlap with building the next frame
+        with ThreadPoolExecutor(max_workers=4) as writer:
+            for i in range(0, len(radar_files)):
+                # Radar targets were already extracted in the calibration pass, only re-project them
+                polar, azimuths = radar_cache[i]
+                cart = radar_polar_to_cartesian(azimuths, polar, radar_resolution, cart_resolution, cart_pixel_width)
+                cv2.threshold(cart, 0, 255, cv2.THRESH_BINARY, dst=cart)
+                x = load_lidar(osp.join(lidar_root, lidar_files[i]))
+                x[0, ...] = x[0, ...] + x_offset
+                x[1, ...] = x[1, ...] + y_offset
+                cart_lidar = lidar_to_cartesian_image(x, cart_pixel_width, cart_resolution)
+                x = np.matmul(R[:2, :2], x)
+                cart_lidar2 = lidar_to_cartesian_image(x, cart_pixel_width, cart_resolution)
+                if light_mode:
+                    # Both images are 0 / 255: lidar only is red, radar only is blue, both is green, neither is white
+                    bgr = np.empty((cart_pixel_width, cart_pixel_width, 3), np.uint8)
+                    bgr[...,0] = ~cart_lidar2
+                    bgr[...,1] = ~(cart_lidar2 ^ cart)
+                    bgr[...,2] = ~cart
                 
-                rgb[...,0] = np.logical_and(cart_lidar2, mask2) * 255
-                rgb[...,1] = np.logical_and(cart, cart_lidar2) * 255
-                rgb[...,2] = np.logical_and(cart, mask) * 255
-                
-                rgb[...,0] = np.logical_or(rgb[...,0], np.logical_and(mask, mask2)) * 255
-                rgb[...,1] = np.logical_or(rgb[...,1], np.logical_and(mask, mask2)) * 255
-                rgb[...,2] = np.logical_or(rgb[...,2], np.logical_and(mask, mask2)) * 255
-                
-                #mask = np.logical_not(cart_lidar2 == 255) * 255
-                #rgb[..., 1] = mask
-                #rgb[..., 2] = mask
-                #mask2 = np.logical_not(cart == 255) * 255
-                #rgb[..., 0] = np.logical_or(cart_lidar2, mask2) * 255
-                #rgb[..., 1] = np.logical_and(rgb[..., 1], mask2) * 255
-                #rgb[..., 2] = np.logical_or(rgb[..., 2], cart) * 255
-                #rgb[..., 0] *= np.logical_not(np.logical_and(cart_lidar2, cart))
-            else:
-                rgb = np.zeros((cart_pixel_width, cart_pixel_width, 3), np.uint8)
-                rgb[..., 0] = cart_lidar2
-                rgb[..., 1] = cart
-
-            cv2.imwrite(osp.join("figs", "combined" + str(i) + ".png"), np.flip(rgb[100:400,200:600,:], axis=2))
-            #cv2.imwrite(osp.join("figs", "combined" + str(i) + ".png"), np.flip(rgb, axis=2))
-            # fig, axs = plt.subplots(1, 3, tight_layout=True)
-            # if light_mode:
-            #     rgb0 = np.ones((cart_pixel_width, cart_pixel_width, 3), np.uint8) * 255
-            #     mask = np.logical_not(cart_lidar == 255) * 255
-            #     rgb0[..., 1] = mask
-            #     rgb0[..., 2] = mask
-            #     rgb1 = np.ones((cart_pixel_width, cart_pixel_width, 3), np.uint8) * 255
-            #     mask2 = np.logical_not(cart == 255) * 255
-            #     rgb1[..., 0] = mask2
-            #     rgb1[..., 1] = mask2
-            #     axs[0].imshow(rgb1)
-            #     axs[1].imshow(rgb0)
-            # else:
-            #     axs[0].imshow(cart, cmap=cm.gray)
-            #     axs[1].imshow(cart_lidar, cmap=cm.gray)
-            # axs[2].imshow(rgb)
-            # plt.show()
+                    #mask = np.logical_not(cart_lidar2 == 255) * 255
+                    #rgb[..., 1] = mask
+                    #rgb[..., 2] = mask
+                    #mask2 = np.logical_not(cart == 255) * 255
+                    #rgb[..., 0] = np.logical_or(cart_lidar2, mask2) * 255
+                    #rgb[..., 1] = np.logical_and(rgb[..., 1], mask2) * 255
+                    #rgb[..., 2] = np.logical_or(rgb[..., 2], cart) * 255
+                    #rgb[..., 0] *= np.logical_not(np.logical_and(cart_lidar2, cart))
+                else:
+                    bgr = np.zeros((cart_pixel_width, cart_pixel_width, 3), np.uint8)
+                    bgr[..., 2] = cart_lidar2
+                    bgr[..., 1] = cart
 
+                # The image is built in OpenCV's BGR order, so the crop can be written without a channel swap copy
+                writer.submit(cv2.imwrite, osp.join("figs", "combined" + str(i) + ".png"), bgr[100:400,200:600])
+                # fig, axs = plt.subplots(1, 3, tight_layout=True)
+                # if light_mode:
+                #     rgb0 = np.ones((cart_pixel_width, cart_pixel_width, 3), np.uint8) * 255
+                #     mask = np.logical_not(cart_lidar == 255) * 255
+                #     rgb0[..., 1] = mask
+                #     rgb0[..., 2] = mask
+                #     rgb1 = np.ones((cart_pixel_width, cart_pixel_width, 3), np.uint8) * 255
+                #     mask2 = np.logical_not(cart == 255) * 255
+                #     rgb1[..., 0] = mask2
+                #     rgb1[..., 1] = mask2
+                #     axs[0].imshow(rgb1)
+                #     axs[1].imshow(rgb0)
+                # else:
+                #     axs[0].imshow(cart, cmap=cm.gray)
+                #     axs[1].imshow(cart_lidar, cmap=cm.gray)
+                # axs[2].imshow(rgb)
+                # plt.show()